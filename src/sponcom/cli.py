@@ -1,12 +1,15 @@
 from __future__ import annotations
 
 import sqlite3
-from datetime import datetime
-from functools import wraps
-from os import popen
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, wraps
+from os import O_CREAT, O_TRUNC, O_WRONLY, environ, fchmod
+from os import open as osOpen
 from pathlib import Path
+from subprocess import PIPE, run
 from sys import argv
-from textwrap import dedent, wrap
+from textwrap import TextWrapper, dedent
+from time import localtime
 from typing import Callable, Concatenate, Coroutine, Literal, ParamSpec, TypeVar
 
 from click import ClickException, argument, echo, group
@@ -16,30 +19,89 @@ from twisted.internet.defer import Deferred
 from twisted.internet.task import react
 
 from sponcom.database import SponsorStorage
+from sponcom.inline import InlineConnectable, runInline
 from sponcom.models import CommitDescriber, Sponsor, StringDescriber, builder, patrons
 from sponcom.schema_builder import SchemaBuilder
 
 # This should probably go in a configuration file.  Maybe a template?
 creatorURL = "https://patreon.com/creatorglyph"
+preamble = "This commit was sponsored by"
+sponsorshipTemplate = (
+    f"{preamble} {{patronText}}, and my other patrons.  If you want to join "
+    f"them, you can support my work at {creatorURL}."
+)
+sponsorshipWrapper = TextWrapper()
 T = TypeVar("T")
 
 
 SponsorAccessor = accessor(SponsorStorage)
 
 
+databasePath = str(Path("~/.sponcom-v1.sqlite").expanduser())
+
+# Recorded in the database file's user_version once the schema has been
+# applied to it; bump this whenever builder.schema changes, so that existing
+# databases pick up the change.
+schemaVersion = 2
+
+# Database paths whose schema has already been applied by this process.
+schemaApplied: set[str] = set()
+
+
 def sqliteWithSchema(builder: SchemaBuilder) -> Callable[[], sqlite3.Connection]:
     def _() -> sqlite3.Connection:
-        connection = sqlite3.connect(str(Path("~/.sponcom-v1.sqlite").expanduser()))
-        connection.executescript(builder.schema)
+        connection = sqlite3.connect(databasePath)
+        # With WAL (see below), synchronous=NORMAL only syncs at checkpoints,
+        # rather than on every commit made by the prepare-commit-msg hook.
+        # These settings only last as long as the connection.
+        connection.executescript(
+            """
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+            PRAGMA busy_timeout=5000;
+            PRAGMA cache_size=-20000;
+            """
+        )
+        # The schema is idempotent, so if two worker threads race to apply it
+        # the worst case is that it's parsed twice.  Otherwise, it's only ever
+        # parsed when the database is created or the schema has changed.
+        if databasePath not in schemaApplied:
+            (version,) = connection.execute("PRAGMA user_version").fetchone()
+            if version < 2:
+                # Replaced by precommit_history in version 2.
+                connection.execute("DROP INDEX IF EXISTS precommit_gid")
+            if version < schemaVersion:
+                # WAL mode, by contrast, persists in the database file, which
+                # from then on is accompanied by -wal and -shm sidecar files.
+                # ANALYZE gives the query planner statistics for the indexes
+                # as they stand whenever the schema changes; empty tables get
+                # none, and the planner falls back to its defaults for them.
+                connection.executescript(
+                    builder.schema
+                    + f"""
+                    PRAGMA journal_mode=WAL;
+                    ANALYZE;
+                    PRAGMA user_version = {schemaVersion};
+                    """
+                )
+            schemaApplied.add(databasePath)
         return connection
 
     return _
 
 
+# The driver pools its connections, each on its own worker thread, so the
+# schema is only applied when a connection is first opened and subsequent
+# transactions in the same process find the page cache already warm.  Our
+# commands only ever run one transaction at a time, so one idle connection is
+# all that's worth keeping around.
 driver = adaptSynchronousDriver(
     sqliteWithSchema(builder),
     sqlite3.paramstyle,
+    maxIdleConnections=1,
 )
+inlineDriver = InlineConnectable(sqliteWithSchema(builder), sqlite3.paramstyle)
 
 
 @group()
@@ -67,8 +129,28 @@ def reactive(
 async def list(reactor: object) -> None:
     async with transaction(driver) as t:
         db = SponsorAccessor(t)
-        async for sponsor in db.sponsors():
-            echo(f"{sponsor.current=} {sponsor.name=} {sponsor.level=} {sponsor.id=}")
+        lines = [
+            f"current={sponsor.current} name={sponsor.name!r}"
+            f" level={sponsor.level} id={sponsor.id}"
+            for sponsor in await db.sponsors()
+        ]
+        if lines:
+            echo("\n".join(lines))
+
+
+@lru_cache
+def zoneWithOffset(seconds: int) -> timezone:
+    return timezone(timedelta(seconds=seconds))
+
+
+def localISOTime(timestamp: float) -> str:
+    """
+    Format C{timestamp} in the local timezone, with the UTC offset in effect
+    at that time (so that history from either side of a DST change is right),
+    without re-resolving the local timezone from scratch for every row.
+    """
+    zone = zoneWithOffset(localtime(timestamp).tm_gmtoff)
+    return datetime.fromtimestamp(timestamp, zone).isoformat()
 
 
 @main.command()
@@ -76,15 +158,17 @@ async def list(reactor: object) -> None:
 async def history(reactor: object) -> None:
     async with transaction(driver) as t:
         db = SponsorAccessor(t)
-        async for gratitude in db.listGratitude():
-            sponsor = await db.sponsorByID(gratitude.sponsor_id)
-            isotime = (
-                datetime.fromtimestamp(gratitude.timestamp).astimezone().isoformat()
+        lines = []
+        async for row in db.listHistory():
+            lines.append(
+                f"{localISOTime(row.timestamp)} {row.sponsorName!r} {row.description!r}"
             )
-            echo(f"{isotime} {sponsor.name!r} {gratitude.description!r}")
-            commit = await db.commitForGratitude(gratitude.id)
-            if commit is not None:
-                echo(f"    commit in {commit.workingDirectory} ({commit.parentCommit})")
+            if row.workingDirectory is not None:
+                lines.append(
+                    f"    commit in {row.workingDirectory} ({row.parentCommit})"
+                )
+        if lines:
+            echo("\n".join(lines))
 
 
 @main.command()
@@ -94,13 +178,38 @@ async def history(reactor: object) -> None:
 async def add(reactor: object, name: str, level: int) -> None:
     async with transaction(driver) as t:
         # print(f"adding sponsor <{name}> at <{level}>")
-        await Sponsor(SponsorAccessor(t), name, level).save()
+        await Sponsor(name, level).save(SponsorAccessor(t))
         echo("saved!")
 
 
 
 
 
+def headCommit() -> str:
+    """
+    Read the commit ID of C{HEAD} straight out of the git directory, rather
+    than spawning a shell and git for every commit; only ask git itself when
+    the layout is anything more exotic than a C{.git} directory holding a
+    loose or packed ref (for example, in a linked worktree).
+    """
+    gitdir = Path(environ.get("GIT_DIR", ".git"))
+    try:
+        head = (gitdir / "HEAD").read_text().strip()
+        if not head.startswith("ref: "):
+            return head
+        ref = head.removeprefix("ref: ")
+        refpath = gitdir / ref
+        if refpath.is_file():
+            return refpath.read_text().strip()
+        for line in (gitdir / "packed-refs").read_text().splitlines():
+            commit, _, name = line.partition(" ")
+            if name == ref:
+                return commit
+    except OSError:
+        pass
+    return run(["git", "rev-parse", "HEAD"], stdout=PIPE, text=True).stdout.strip()
+
+
 # This is the git prepare-commit-message hook.
 @main.command(hidden=True)
 
@@ -128,32 +237,27 @@ async def add(reactor: object, name: str, level: int) -> None:
 # If the second argument is 'commit', then the third will be a commit object
 # name (if a -c, -C or --amend option was given).
 
-@reactive
-async def prepare(
-    reactor: object,
+def prepare(
     premessagepath: str,
     commitsource: Literal["message", "template", "merge", "squash", "commit"] | None,
     commitobject: str | None = None,
 ) -> None:
     """
     Git prepare-commit-message hook.
-    """
-    import os
-    from pprint import pformat
-
-    preamble = "This commit was sponsored by"
 
-    echo(pformat(dict(os.environ)))
-    with Path(premessagepath).open("r+") as f:
-        userMessage = f.read()
-        if preamble in userMessage:
-            return
+    Since this runs on every commit and then exits, it talks to the database
+    inline, rather than starting up the reactor and a worker thread.
+    """
+    messagePath = Path(premessagepath)
+    userMessage = messagePath.read_text()
+    if preamble in userMessage:
+        return
 
-        with popen("git rev-parse HEAD") as gitProcess:
-            parentCommit = gitProcess.read().strip()
+    parentCommit = headCommit()
 
-        patronText = await patrons(
-            driver,
+    patronText = runInline(
+        patrons(
+            inlineDriver,
             3,
             CommitDescriber(
                 userMessage,
@@ -164,21 +268,17 @@ async def prepare(
                 parentCommit,
             ),
         )
-        msg = wrap(
-            dedent(
-                f"""\
-                {preamble} {patronText}, and my other patrons.  If you want to
-                join them, you can support my work at {creatorURL}.
-                """
-            )
-        )
+    )
+    msg = sponsorshipWrapper.wrap(sponsorshipTemplate.format(patronText=patronText))
 
-        if userMessage[-1:] != "\n":
-            f.write("\n\n")
-        elif userMessage[-2:] != "\n\n":
-            f.write("\n")
+    if not userMessage.endswith("\n"):
+        separator = "\n\n"
+    elif not userMessage.endswith("\n\n"):
+        separator = "\n"
+    else:
+        separator = ""
 
-        f.write("\n".join(msg))
+    messagePath.write_text(userMessage + separator + "\n".join(msg))
 
 
 @main.command()
@@ -189,7 +289,11 @@ def install() -> None:
     hooksdir = gitdir / "hooks"
     hooksdir.mkdir(mode=0o755, parents=False, exist_ok=True)
     hookpath = hooksdir / "prepare-commit-msg"
-    with hookpath.open("w") as f:
+    fd = osOpen(hookpath, O_WRONLY | O_CREAT | O_TRUNC, 0o755)
+    with open(fd, "w") as f:
+        # The mode above is subject to the umask, and ignored entirely when
+        # replacing an existing hook, so set it before there's any content.
+        fchmod(fd, 0o755)
         f.write(
             dedent(
                 f"""\
@@ -198,7 +302,6 @@ def install() -> None:
                 """
             )
         )
-    hookpath.chmod(0o755)
     echo(f"installed {hookpath}")
 
 
@@ -1,8 +1,191 @@
-from typing import AsyncIterable, Protocol
+from array import array
+from dataclasses import dataclass, field
+from typing import AsyncIterable, Awaitable, Callable, Protocol, TypeVar
 
-from dbxs import many, maybe, one, query, statement
+from dbxs import maybe, one, query, statement
+from dbxs.dbapi_async import AsyncConnection, AsyncCursor
 
-from .models import CommitRecord, Gratitude, Sponsor
+from .models import CommitRecord, Gratitude, GratitudeColumns, HistoryRow, Sponsor
+
+T = TypeVar("T")
+
+
+def scalar(storage: object, value: T) -> T:
+    """
+    Load a single-column row as its bare value.
+    """
+    return value
+
+
+def asTuple(storage: object, *row: T) -> tuple[T, ...]:
+    """
+    Load a row as a plain tuple of its values.
+    """
+    return row
+
+
+def fromRow(load: Callable[..., T]) -> Callable[..., T]:
+    """
+    Adapt a row class, which does not keep a reference to the storage that
+    loaded it, to the dbxs loader signature, which passes that storage first.
+    """
+
+    def loadRow(storage: object, *row: object) -> T:
+        return load(*row)
+
+    return loadRow
+
+
+async def countRows(db: object, cursor: AsyncCursor) -> int:
+    """
+    Load the number of rows in the result, rather than the rows themselves.
+    """
+    return len(await cursor.fetchall())
+
+
+def allRows(
+    load: Callable[..., T]
+) -> Callable[[object, AsyncCursor], Awaitable[list[T]]]:
+    """
+    Like L{dbxs.many}, but load every row in one fetch, for results that are
+    small enough to hold in memory all at once.
+    """
+
+    async def translate(db: object, cursor: AsyncCursor) -> list[T]:
+        return [load(db, *row) for row in await cursor.fetchall()]
+
+    return translate
+
+
+def chunked(
+    load: Callable[..., T], size: int = 1000
+) -> Callable[[object, AsyncCursor], AsyncIterable[T]]:
+    """
+    Like L{dbxs.many}, but fetch rows from the database thread C{size} at a
+    time, rather than making one round-trip per row.
+    """
+
+    async def translate(db: object, cursor: AsyncCursor) -> AsyncIterable[T]:
+        while rows := await cursor.fetchmany(size):
+            for row in rows:
+                yield load(db, *row)
+
+    return translate
+
+
+async def gratitudeColumns(db: object, cursor: AsyncCursor) -> GratitudeColumns:
+    """
+    Load the whole result in one fetch, transposed into L{GratitudeColumns}.
+    """
+    rows = await cursor.fetchall()
+    ids, sponsorIDs, timestamps, descriptions = zip(*rows) if rows else ([],) * 4
+    return GratitudeColumns(
+        list(ids), list(sponsorIDs), array("d", timestamps), list(descriptions)
+    )
+
+
+saveSponsorSQL = """
+INSERT INTO sponsor(id, name, level, current)
+VALUES({id}, {name}, {level}, {current})
+ON CONFLICT(sponsor.id)
+DO UPDATE SET
+(name, level, current) =
+(EXCLUDED.name, EXCLUDED.level, EXCLUDED.current)
+"""
+
+addGratitudeSQL = """
+INSERT INTO gratitude(id, sponsor_id, timestamp, description)
+VALUES ({id}, {sponsor_id}, {timestamp}, {description})
+"""
+
+addCommitSQL = """
+INSERT INTO precommit (gratitude_id, commit_message, working_directory,
+                       pre_message_path, commit_source, commit_object,
+                       parent_commit)
+VALUES ({gratitudeID}, {userMessage}, {workingDirectory},
+        {preMessagePath}, {commitSource}, {commitObject}, {parentCommit})
+"""
+
+
+class NamedPlaceholders(dict[str, str]):
+    """
+    Format map rendering dbxs-style C{{name}} placeholders as DB-API C{named}
+    parameters, for statements that dbxs cannot execute for us.
+    """
+
+    def __missing__(self, name: str) -> str:
+        return f":{name}"
+
+
+# Rendered once, so that every batch hands sqlite3 the very same SQL strings,
+# which its per-connection statement cache can match without re-preparing.
+addGratitudeManySQL = addGratitudeSQL.format_map(NamedPlaceholders())
+addCommitManySQL = addCommitSQL.format_map(NamedPlaceholders())
+
+
+@dataclass
+class GratitudeBatch:
+    """
+    The writes made while thanking several sponsors at once, accumulated so
+    that they can be issued with one C{executemany} per statement rather than
+    one round-trip per row.  Its methods mirror the L{SponsorStorage}
+    statements of the same names.
+    """
+
+    gratitudes: list[dict[str, object]] = field(default_factory=list)
+    commits: list[dict[str, object]] = field(default_factory=list)
+
+    def addGratitude(
+        self, id: str, sponsor_id: str, timestamp: float, description: str
+    ) -> None:
+        self.gratitudes.append(
+            dict(
+                id=id,
+                sponsor_id=sponsor_id,
+                timestamp=timestamp,
+                description=description,
+            )
+        )
+
+    def addCommit(
+        self,
+        gratitudeID: str,
+        userMessage: str,
+        workingDirectory: str,
+        preMessagePath: str,
+        commitSource: str | None,
+        commitObject: str | None,
+        parentCommit: str,
+    ) -> None:
+        self.commits.append(
+            dict(
+                gratitudeID=gratitudeID,
+                userMessage=userMessage,
+                workingDirectory=workingDirectory,
+                preMessagePath=preMessagePath,
+                commitSource=commitSource,
+                commitObject=commitObject,
+                parentCommit=parentCommit,
+            )
+        )
+
+    async def flush(self, connection: AsyncConnection) -> None:
+        """
+        Write everything accumulated so far within C{connection}'s
+        transaction.  Gratitude goes in before the commit records that refer
+        to it.
+        """
+        cursor = await connection.cursor()
+        try:
+            for sql, rows in [
+                (addGratitudeManySQL, self.gratitudes),
+                (addCommitManySQL, self.commits),
+            ]:
+                if rows:
+                    await cursor.executemany(sql, rows)
+        finally:
+            await cursor.close()
+        self.gratitudes, self.commits = [], []
 
 
 class SponsorStorage(Protocol):
@@ -13,24 +196,15 @@ class SponsorStorage(Protocol):
     @query(
         sql="""
         SELECT
-            name, level, current
+            name, level, current, id
         FROM sponsor;
         """,
-        load=many(Sponsor),
+        load=allRows(fromRow(Sponsor.loaded)),
     )
-    def sponsors(self) -> AsyncIterable[Sponsor]:
+    async def sponsors(self) -> list[Sponsor]:
         ...
 
-    @statement(
-        sql="""
-        INSERT INTO sponsor(id, name, level, current)
-        VALUES({id}, {name}, {level}, {current})
-        ON CONFLICT(sponsor.id)
-        DO UPDATE SET
-        (name, level, current) =
-        (EXCLUDED.name, EXCLUDED.level, EXCLUDED.current)
-        """
-    )
+    @statement(sql=saveSponsorSQL)
     async def saveSponsor(
         self,
         id: str,
@@ -43,27 +217,80 @@ class SponsorStorage(Protocol):
     @query(
         sql="""
         SELECT
-            name, level, current
+            name, level, current, id
         FROM sponsor
         WHERE id = {id};
         """,
-        load=one(Sponsor),
+        load=one(fromRow(Sponsor.loaded)),
     )
     async def sponsorByID(self, id: str) -> Sponsor:
         ...
 
     @query(
         sql="""
-        SELECT
-            name, level, current, id
+        SELECT COUNT(*)
         FROM sponsor
+        WHERE current > 0;
+        """,
+        load=one(scalar),
+    )
+    async def countActive(self) -> int:
+        ...
+
+    @statement(sql="BEGIN IMMEDIATE;")
+    async def lockForWriting(self) -> None:
+        """
+        Start the transaction by taking the database's write lock, so that
+        nothing else can change which sponsors are active between counting
+        them and drawing some.  (sqlite3 would otherwise only begin the
+        transaction at the first data-modifying statement.)
+        """
+
+    @query(
+        sql="""
+        SELECT rowid
+        FROM sponsor INDEXED BY sponsor_active
         WHERE current > 0
-        ORDER BY random()
-        LIMIT {limit};
+        LIMIT 1 OFFSET {offset};
+        """,
+        load=one(scalar),
+    )
+    async def activeRowID(self, offset: int) -> int:
+        """
+        Find the row ID of the active sponsor at C{offset}, which must be less
+        than L{SponsorStorage.countActive} as of the same transaction (see
+        L{SponsorStorage.lockForWriting}), by stepping through the partial
+        C{sponsor_active} index alone.  Picking offsets at random avoids
+        sorting every active sponsor by C{random()} on every draw.
+        """
+
+    @query(
+        sql="""
+        UPDATE sponsor
+        SET current = current - 1
+        WHERE rowid IN (SELECT value FROM json_each({rowIDs}))
+        AND current > 0
+        RETURNING id, name;
+        """,
+        load=chunked(asTuple),
+    )
+    def draw(self, rowIDs: str) -> AsyncIterable[tuple[str, str]]:
+        """
+        Decrement the count of each sponsor in C{rowIDs}, a JSON list of row
+        IDs, and load just the ID and name of each, which is all that
+        thanking them needs.
+        """
+
+    @query(
+        sql="""
+        SELECT
+            id, sponsor_id, timestamp, description
+        FROM gratitude
+        ORDER BY timestamp ASC
         """,
-        load=many(Sponsor),
+        load=allRows(fromRow(Gratitude)),
     )
-    def draw(self, limit: int) -> AsyncIterable[Sponsor]:
+    async def listGratitude(self) -> list[Gratitude]:
         ...
 
     @query(
@@ -73,31 +300,33 @@ class SponsorStorage(Protocol):
         FROM gratitude
         ORDER BY timestamp ASC
         """,
-        load=many(Gratitude),
+        load=gratitudeColumns,
     )
-    def listGratitude(self) -> AsyncIterable[Gratitude]:
+    async def listGratitudeColumns(self) -> GratitudeColumns:
         ...
 
-    @statement(
+    @query(
         sql="""
-        INSERT INTO gratitude(id, sponsor_id, timestamp, description)
-        VALUES ({id}, {sponsor_id}, {timestamp}, {description})
-        """
+        SELECT
+            gratitude.timestamp, sponsor.name, gratitude.description,
+            precommit.working_directory, precommit.parent_commit
+        FROM gratitude
+        JOIN sponsor ON sponsor.id = gratitude.sponsor_id
+        LEFT JOIN precommit ON precommit.gratitude_id = gratitude.id
+        ORDER BY gratitude.timestamp ASC
+        """,
+        load=chunked(fromRow(HistoryRow)),
     )
+    def listHistory(self) -> AsyncIterable[HistoryRow]:
+        ...
+
+    @statement(sql=addGratitudeSQL)
     async def addGratitude(
         self, id: str, sponsor_id: str, timestamp: float, description: str
     ) -> None:
         ...
 
-    @statement(
-        sql="""
-        INSERT INTO precommit (gratitude_id, commit_message, working_directory,
-                               pre_message_path, commit_source, commit_object,
-                               parent_commit)
-        VALUES ({gratitudeID}, {userMessage}, {workingDirectory},
-                {preMessagePath}, {commitSource}, {commitObject}, {parentCommit})
-        """
-    )
+    @statement(sql=addCommitSQL)
     async def addCommit(
         self,
         gratitudeID: str,
@@ -110,14 +339,20 @@ class SponsorStorage(Protocol):
     ) -> None:
         ...
 
-    @statement(
+    @query(
         sql="""
         UPDATE sponsor
-        SET current = level;
+        SET current = level
+        WHERE level > 0
+        RETURNING 1;
         """,
+        load=countRows,
     )
-    async def fullReset(self) -> None:
-        ...
+    async def fullReset(self) -> int:
+        """
+        Restore every sponsor's credit, and return how many are active
+        afterwards, without a separate L{SponsorStorage.countActive}.
+        """
 
     @query(
         sql="""
@@ -128,7 +363,7 @@ class SponsorStorage(Protocol):
         FROM precommit
         WHERE gratitude_id = {gratitude_id}
         """,
-        load=maybe(CommitRecord),
+        load=maybe(fromRow(CommitRecord)),
     )
     async def commitForGratitude(self, gratitude_id: str) -> CommitRecord | None:
         ...
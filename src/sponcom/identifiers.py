@@ -0,0 +1,42 @@
+"""
+Random identifiers for new rows.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from os import register_at_fork, urandom
+
+
+@dataclass
+class IdentifierPool:
+    """
+    Version 4 UUIDs, formatted as hex, cut from one large read of
+    C{os.urandom} rather than making a system call (and a L{uuid.UUID}) for
+    each one.
+    """
+
+    batchSize: int = 256
+    buffer: bytes = b""
+    offset: int = 0
+
+    def reset(self) -> None:
+        """
+        Discard any unused randomness, so it can't be handed out twice (for
+        example, by both sides of a fork).
+        """
+        self.buffer, self.offset = b"", 0
+
+    def next(self) -> str:
+        if self.offset >= len(self.buffer):
+            self.buffer, self.offset = urandom(16 * self.batchSize), 0
+        raw = bytearray(self.buffer[self.offset : self.offset + 16])
+        self.offset += 16
+        raw[6] = raw[6] & 0x0F | 0x40  # version 4
+        raw[8] = raw[8] & 0x3F | 0x80  # RFC 4122 variant
+        return raw.hex()
+
+
+identifiers = IdentifierPool()
+register_at_fork(after_in_child=identifiers.reset)
+newID = identifiers.next
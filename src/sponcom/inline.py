@@ -0,0 +1,115 @@
+"""
+Same-thread implementations of dbxs's asynchronous DB-API protocols, for
+short-lived commands that would otherwise spend longer starting a reactor and a
+worker thread than they spend talking to the database.
+"""
+
+from __future__ import annotations
+
+import sqlite3
+from dataclasses import dataclass
+from typing import Any, Callable, Coroutine, Mapping, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+@dataclass
+class InlineCursor:
+    """
+    An C{AsyncCursor} whose every method completes before it returns.
+    """
+
+    _cursor: sqlite3.Cursor
+
+    async def description(self) -> Any:
+        return self._cursor.description
+
+    async def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    async def fetchone(self) -> Optional[Sequence[Any]]:
+        result: Optional[Sequence[Any]] = self._cursor.fetchone()
+        return result
+
+    async def fetchmany(self, size: Optional[int] = None) -> Sequence[Sequence[Any]]:
+        if size is None:
+            return self._cursor.fetchmany()
+        return self._cursor.fetchmany(size)
+
+    async def fetchall(self) -> Sequence[Sequence[Any]]:
+        return self._cursor.fetchall()
+
+    async def execute(
+        self,
+        operation: str,
+        parameters: Sequence[Any] | Mapping[str, Any] = (),
+    ) -> object:
+        return self._cursor.execute(operation, parameters)
+
+    async def executemany(
+        self, operation: str, seqOfParameters: Sequence[Sequence[Any]]
+    ) -> object:
+        return self._cursor.executemany(operation, seqOfParameters)
+
+    async def close(self) -> None:
+        self._cursor.close()
+
+
+@dataclass
+class InlineConnection:
+    """
+    An C{AsyncConnection} wrapping a sqlite3 connection on the calling thread.
+    """
+
+    _connection: sqlite3.Connection
+    paramstyle: str
+
+    async def cursor(self) -> InlineCursor:
+        return InlineCursor(self._connection.cursor())
+
+    async def rollback(self) -> None:
+        self._connection.rollback()
+
+    async def commit(self) -> None:
+        self._connection.commit()
+
+    async def close(self) -> None:
+        self._connection.close()
+
+
+@dataclass
+class InlineConnectable:
+    """
+    An C{AsyncConnectable} that opens one connection on first use and hands
+    it out for every transaction after that.  Since nothing here ever
+    suspends, transactions cannot overlap.
+    """
+
+    connectCallable: Callable[[], sqlite3.Connection]
+    paramstyle: str
+    _connection: Optional[InlineConnection] = None
+
+    async def connect(self) -> InlineConnection:
+        if self._connection is None:
+            self._connection = InlineConnection(self.connectCallable(), self.paramstyle)
+        return self._connection
+
+    async def quit(self) -> None:
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            await connection.close()
+
+
+def runInline(coroutine: Coroutine[Any, Any, T]) -> T:
+    """
+    Run C{coroutine} to completion right now, without an event loop.  Every
+    awaitable it waits on must already have its result, as is the case for
+    everything in this module (and for L{Deferred}s that have already fired).
+    """
+    try:
+        coroutine.send(None)
+    except StopIteration as stop:
+        result: T = stop.value
+        return result
+    coroutine.close()
+    raise RuntimeError(f"{coroutine!r} waited on something that was not inline")
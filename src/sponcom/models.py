@@ -1,27 +1,31 @@
 from __future__ import annotations
 
+from array import array
 from dataclasses import dataclass, field
+from json import dumps
+from random import sample, shuffle
 from time import time
 from typing import TYPE_CHECKING, Protocol
-from uuid import uuid4
 
 from click import echo
 from dbxs.dbapi_async import AsyncConnectable
 
 
 from .cli import transaction
+from .identifiers import newID
 from .schema_builder import SchemaBuilder
 
 if TYPE_CHECKING:
-    # SponsorStorage is a protocol, therefore only used at type-check time.
-    from .database import SponsorStorage
+    # SponsorStorage is a protocol, therefore only used at type-check time;
+    # GratitudeBatch is imported where it's needed, as .database imports us.
+    from .database import GratitudeBatch, SponsorStorage
 
 builder = SchemaBuilder()
 
 class GratitudeDescriber(Protocol):
-    async def describeGratitude(
+    def describeGratitude(
         self,
-        storage: SponsorStorage,
+        batch: GratitudeBatch,
         timestamp: float,
         gratitudeID: str,
     ) -> None:
@@ -31,10 +35,8 @@ class GratitudeDescriber(Protocol):
         ...
 
 @builder.table("sponsor")
-@dataclass
+@dataclass(slots=True)
 class Sponsor:
-    storage: SponsorStorage = field(repr=False)
-
     name: str
     builder.column("name TEXT NOT NULL")
 
@@ -46,35 +48,40 @@ class Sponsor:
     # __post_init__.  It defaults to being the same value as `level`.
     builder.column("current INTEGER NOT NULL")
 
-    id: str = field(default_factory=lambda: str(uuid4()))
+    id: str = field(default_factory=newID)
     builder.column("id uuid PRIMARY KEY NOT NULL")
 
+    builder.index(
+        "CREATE INDEX IF NOT EXISTS sponsor_active ON sponsor(current)"
+        " WHERE current > 0"
+    )
+
     def __post_init__(self) -> None:
         if self.current is None:
             self.current = self.level
 
-    async def save(self) -> None:
-        await self.storage.saveSponsor(
+    @classmethod
+    def loaded(cls, name: str, level: int, current: int, id: str) -> Sponsor:
+        """
+        Load a sponsor from a database row, which always has every column,
+        without going through C{__init__} and C{__post_init__}.
+        """
+        sponsor = cls.__new__(cls)
+        sponsor.name = name
+        sponsor.level = level
+        sponsor.current = current
+        sponsor.id = id
+        return sponsor
+
+    async def save(self, storage: SponsorStorage) -> None:
+        await storage.saveSponsor(
             id=self.id, name=self.name, level=self.level, current=self.current
         )
 
-    async def thank(self, timestamp: float, describer: GratitudeDescriber) -> None:
-        gratitudeID = str(uuid4())
-        await self.storage.addGratitude(
-            id=gratitudeID,
-            sponsor_id=self.id,
-            timestamp=timestamp,
-            description=describer.descriptionString(),
-        )
-        await describer.describeGratitude(self.storage, timestamp, gratitudeID)
-        self.current -= 1
-        await self.save()
-
 
 @builder.table("gratitude")
-@dataclass
+@dataclass(slots=True)
 class Gratitude:
-    storage: SponsorStorage = field(repr=False)
     id: str
     builder.column("id UUID NOT NULL")
 
@@ -88,13 +95,26 @@ class Gratitude:
     builder.column("description TEXT NOT NULL")
 
     builder.constraint("FOREIGN KEY (sponsor_id) REFERENCES sponsor(id)")
+    builder.index("CREATE INDEX IF NOT EXISTS gratitude_ts ON gratitude(timestamp)")
+
+
+@dataclass(slots=True)
+class GratitudeColumns:
+    """
+    Every gratitude record, stored column by column for bulk analysis rather
+    than as one L{Gratitude} per row; timestamps are packed into a single
+    C{array} of doubles.
+    """
+
+    ids: list[str]
+    sponsorIDs: list[str]
+    timestamps: array[float]
+    descriptions: list[str]
 
 
 @builder.table("precommit")
-@dataclass
+@dataclass(slots=True)
 class CommitRecord:
-    storage: SponsorStorage
-
     gratitudeID: str
     builder.column("gratitude_id UUID NOT NULL")
 
@@ -117,9 +137,28 @@ class CommitRecord:
     builder.column("parent_commit TEXT NOT NULL")
 
     builder.constraint("FOREIGN KEY (gratitude_id) REFERENCES gratitude(id)")
+    # Covers the history listing's join, which needs only these columns.
+    builder.index(
+        "CREATE INDEX IF NOT EXISTS precommit_history"
+        " ON precommit(gratitude_id, working_directory, parent_commit)"
+    )
+
 
+@dataclass(slots=True)
+class HistoryRow:
+    """
+    A gratitude record joined with the name of its sponsor and, if it was for
+    a commit, the commit's details.
+    """
 
-@dataclass
+    timestamp: float
+    sponsorName: str
+    description: str
+    workingDirectory: str | None
+    parentCommit: str | None
+
+
+@dataclass(slots=True)
 class CommitDescriber:
     userMessage: str
     preMessagePath: str
@@ -127,17 +166,21 @@ class CommitDescriber:
     commitSource: str | None
     commitObject: str | None
     parentCommit: str
+    description: str = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        self.description = f"commit from {self.workingDirectory}"
 
     def descriptionString(self) -> str:
-        return f"commit from {self.workingDirectory}"
+        return self.description
 
-    async def describeGratitude(
+    def describeGratitude(
         self,
-        storage: SponsorStorage,
+        batch: GratitudeBatch,
         timestamp: float,
         gratitudeID: str,
     ) -> None:
-        await storage.addCommit(
+        batch.addCommit(
             gratitudeID,
             self.userMessage,
             self.workingDirectory,
@@ -148,39 +191,64 @@ class CommitDescriber:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class StringDescriber:
     string: str
 
     def descriptionString(self) -> str:
         return self.string
 
-    async def describeGratitude(
+    def describeGratitude(
         self,
-        storage: SponsorStorage,
+        batch: GratitudeBatch,
         timestamp: float,
         gratitudeID: str,
     ) -> None:
         ...
 
 
-async def patrons(driver: AsyncConnectable, howMany: int, describer: GratitudeDescriber) -> str:
-    from sponcom.cli import SponsorAccessor
-
-    for repeat in range(2):
-        async with transaction(driver) as t:
-            names = []
-            timestamp = time()
-            acc = SponsorAccessor(t)
-            async for sponsor in acc.draw(howMany):
-                await sponsor.thank(timestamp, describer)
-                names.append(sponsor.name)
-            if names:
-                return ", ".join(names)
-            else:
-                await acc.fullReset()
-                echo("* resetting")
-
-    return "just me"
+def thank(
+    batch: GratitudeBatch,
+    timestamp: float,
+    describer: GratitudeDescriber,
+    sponsorID: str,
+) -> None:
+    """
+    Record gratitude to the sponsor identified by C{sponsorID} in C{batch}.
+    """
+    gratitudeID = newID()
+    batch.addGratitude(
+        id=gratitudeID,
+        sponsor_id=sponsorID,
+        timestamp=timestamp,
+        description=describer.descriptionString(),
+    )
+    describer.describeGratitude(batch, timestamp, gratitudeID)
 
 
+async def patrons(driver: AsyncConnectable, howMany: int, describer: GratitudeDescriber) -> str:
+    from sponcom.cli import SponsorAccessor
+    from sponcom.database import GratitudeBatch
+
+    async with transaction(driver) as t:
+        acc = SponsorAccessor(t)
+        await acc.lockForWriting()
+        timestamp = time()
+        active = await acc.countActive()
+        if not active:
+            active = await acc.fullReset()
+            echo("* resetting")
+        if not active:
+            return "just me"
+        rowIDs = [
+            await acc.activeRowID(offset)
+            for offset in sample(range(active), min(howMany, active))
+        ]
+        drawn = [row async for row in acc.draw(dumps(rowIDs))]
+        # draw loads sponsors in table order.
+        shuffle(drawn)
+        batch = GratitudeBatch()
+        for sponsorID, name in drawn:
+            thank(batch, timestamp, describer, sponsorID)
+        await batch.flush(t)
+        return ", ".join(name for sponsorID, name in drawn)
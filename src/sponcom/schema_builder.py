@@ -1,29 +1,22 @@
+from __future__ import annotations
 
 from dataclasses import dataclass, field
-from typing import Callable, TypeVar
+from typing import TypeVar
 
 T = TypeVar("T")
 @dataclass
 class SchemaBuilder:
-    schema: str = ""
+    parts: list[str] = field(default_factory=lambda: [])
     pendingColumns: list[str] = field(default_factory=lambda: [])
+    pendingIndexes: list[str] = field(default_factory=lambda: [])
     constraintsYet: bool = False
 
-    def table(self, tableName: str) -> Callable[[T], T]:
+    @property
+    def schema(self) -> str:
+        return "".join(self.parts)
 
-        def buildSchema(c: T) -> T:
-            pendingColumns, self.pendingColumns = self.pendingColumns, []
-            sep = ",\n    "
-            partialSchema = f"""
-            CREATE TABLE IF NOT EXISTS {tableName} (
-                {sep.join(pendingColumns)}
-            );
-            """
-            self.schema += partialSchema
-            c.__schema__ = partialSchema  # type:ignore
-            return c
-
-        return buildSchema
+    def table(self, tableName: str) -> TableDecorator:
+        return TableDecorator(self, tableName)
 
     def column(self, columnText: str) -> None:
         self.constraintsYet = False
@@ -35,4 +28,36 @@ class SchemaBuilder:
         self.constraintsYet = True
         self.pendingColumns.append(constraintText)
 
+    def index(self, indexText: str) -> None:
+        # Indexes are declared inside the class body, before the table
+        # exists, so they're held until the table has been created.
+        self.pendingIndexes.append(indexText)
+
 
+@dataclass
+class TableDecorator:
+    """
+    Finish the table named C{tableName} with every column, constraint and
+    index declared in C{builder} since the previous table.
+    """
+
+    builder: SchemaBuilder
+    tableName: str
+
+    def __call__(self, c: T) -> T:
+        builder = self.builder
+        pendingColumns, builder.pendingColumns = builder.pendingColumns, []
+        pendingIndexes, builder.pendingIndexes = builder.pendingIndexes, []
+        sep = ",\n    "
+        partialSchema = f"""
+            CREATE TABLE IF NOT EXISTS {self.tableName} (
+                {sep.join(pendingColumns)}
+            );
+            """
+        for indexText in pendingIndexes:
+            partialSchema += f"""
+            {indexText};
+            """
+        builder.parts.append(partialSchema)
+        c.__schema__ = partialSchema  # type:ignore
+        return c